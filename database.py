@@ -289,6 +289,57 @@ def get_all_ssh_hosts(enabled_only: bool = True):
         return []
 
 
+def get_ssh_host(host: str, user: str):
+    """Retrieve a single SSH host by host and plaintext user, or None.
+
+    The user column is encrypted non-deterministically, so rows are selected
+    by host (covered by the UNIQUE(host, user) index) and the user is matched
+    after decryption, avoiding a full-table fetch and decrypt.
+    """
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT id, host, user, command, description, enabled,
+                   last_check, last_status, last_error, created_at, updated_at
+            FROM ssh_hosts
+            WHERE host = ?
+        """, (host,))
+
+        results = cursor.fetchall()
+        conn.close()
+
+        for row in results:
+            try:
+                decrypted_user = encryption.decrypt(row[2]) if encryption.is_initialized() else row[2]
+            except Exception:
+                # Fallback to raw value if decryption fails (backward compatibility)
+                decrypted_user = row[2]
+
+            if decrypted_user != user:
+                continue
+
+            return {
+                "id": row[0],
+                "host": row[1],
+                "user": decrypted_user,
+                "command": "",
+                "description": row[4],
+                "enabled": bool(row[5]),
+                "last_check": row[6],
+                "last_status": row[7],
+                "last_error": row[8],
+                "created_at": row[9],
+                "updated_at": row[10]
+            }
+
+        return None
+    except Exception as e:
+        print(f"Failed to retrieve SSH host: {e}")
+        return None
+
+
 def delete_ssh_host(host: str, user: str):
     """Delete an SSH host from the database."""
     try:
@@ -461,6 +512,50 @@ def get_all_api_hosts(enabled_only: bool = True):
         return []
 
 
+def get_api_host(host: str):
+    """Retrieve a single API host by hostname (unique), or None."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT id, host, api_type, api_key, api_endpoint, description, enabled,
+                   last_check, last_status, last_error, created_at, updated_at
+            FROM api_hosts
+            WHERE host = ?
+        """, (host,))
+
+        row = cursor.fetchone()
+        conn.close()
+
+        if row is None:
+            return None
+
+        try:
+            decrypted_api_key = encryption.decrypt(row[3]) if encryption.is_initialized() and row[3] else row[3]
+        except Exception:
+            # Fallback to raw value if decryption fails (backward compatibility)
+            decrypted_api_key = row[3]
+
+        return {
+            "id": row[0],
+            "host": row[1],
+            "api_type": row[2],
+            "api_key": decrypted_api_key,
+            "api_endpoint": row[4],
+            "description": row[5],
+            "enabled": bool(row[6]),
+            "last_check": row[7],
+            "last_status": row[8],
+            "last_error": row[9],
+            "created_at": row[10],
+            "updated_at": row[11]
+        }
+    except Exception as e:
+        print(f"Failed to retrieve API host: {e}")
+        return None
+
+
 def delete_api_host(host: str):
     """Delete an API host from the database."""
     try:
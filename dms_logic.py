@@ -2,6 +2,7 @@ import os
 import logging
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Optional, Any
 from datetime import datetime
 from colorama import Fore, Back, Style, init as colorama_init
@@ -212,43 +213,55 @@ def stop_monitoring() -> None:
     logger.info("Monitoring stopped")
 
 
+def _shutdown_single_host(host_data: dict, plugin_type: str, phase_name: str) -> dict:
+    """Shut down one host and return its result entry."""
+    try:
+        plugin = get_plugin(plugin_type)
+
+        if plugin_type == "ssh":
+            private_key = get_ssh_private_key()
+            config = {
+                "host": host_data["host"],
+                "user": host_data["user"],
+                "private_key": private_key
+            }
+        else:
+            config = {
+                "host": host_data["host"],
+                "api_key": host_data.get("api_key", ""),
+                "api_endpoint": host_data.get("api_endpoint", "")
+            }
+
+        result = plugin.execute_shutdown(config)
+
+        logger.info(f"{phase_name}: {result['host']} - {result['status']}")
+        log_action(f"{phase_name}_shutdown", f"{result['host']}: {result['status']}", "DMS", "info")
+        return result
+
+    except Exception as e:
+        logger.error(f"{phase_name} failed for {host_data.get('host')}: {e}")
+        return {
+            "host": host_data.get("host"),
+            "status": "error",
+            "details": str(e)
+        }
+
+
 def execute_shutdown_phase(hosts: list, plugin_type: str, phase_name: str) -> list:
-    """Execute shutdown for a group of hosts."""
-    results = []
-    
-    for host_data in hosts:
-        try:
-            plugin = get_plugin(plugin_type)
-            
-            if plugin_type == "ssh":
-                private_key = get_ssh_private_key()
-                config = {
-                    "host": host_data["host"],
-                    "user": host_data["user"],
-                    "private_key": private_key
-                }
-            else:
-                config = {
-                    "host": host_data["host"],
-                    "api_key": host_data.get("api_key", ""),
-                    "api_endpoint": host_data.get("api_endpoint", "")
-                }
-            
-            result = plugin.execute_shutdown(config)
-            results.append(result)
-            
-            logger.info(f"{phase_name}: {result['host']} - {result['status']}")
-            log_action(f"{phase_name}_shutdown", f"{result['host']}: {result['status']}", "DMS", "info")
-            
-        except Exception as e:
-            logger.error(f"{phase_name} failed for {host_data.get('host')}: {e}")
-            results.append({
-                "host": host_data.get("host"),
-                "status": "error",
-                "details": str(e)
-            })
-    
-    return results
+    """Execute shutdown for a group of hosts.
+
+    Hosts within a phase are independent, so they run in parallel
+    threads; the phase takes roughly the slowest host's time instead
+    of the sum of every timeout.
+    """
+    if not hosts:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(32, len(hosts))) as pool:
+        return list(pool.map(
+            lambda host_data: _shutdown_single_host(host_data, plugin_type, phase_name),
+            hosts
+        ))
 
 
 def initiate_hard_poweroff() -> Dict[str, Any]:
@@ -23,7 +23,11 @@ from dms_logic import (
     start_monitoring, stop_monitoring,
     initiate_hard_poweroff, get_shutdown_status, is_shutdown_in_progress
 )
-from telegram_bot import notify_new_ip, notify_shutdown, notify_host_added, notify_host_removed, start_bot
+from telegram_bot import (
+    notify_new_ip, notify_shutdown, notify_host_added, notify_host_removed, start_bot,
+    is_webhook_configured, start_webhook, stop_webhook, process_webhook_update,
+    verify_webhook_secret
+)
 from plugins import list_plugins
 
 logger = logging.getLogger(__name__)
@@ -57,7 +61,11 @@ async def lifespan(app: FastAPI):
         static_token, totp_secret = setup_secrets()
         log_action("startup", "API initialized", "SYSTEM", "info")
         start_monitoring()
-        start_bot()
+        if is_webhook_configured():
+            # Telegram pushes updates to /telegram/webhook; no polling thread
+            await start_webhook()
+        else:
+            start_bot()
         started = True
     else:
         logger.warning("Setup required: configure MASTER_SECRET in .env and restart.")
@@ -67,6 +75,7 @@ async def lifespan(app: FastAPI):
     
     if started:
         stop_monitoring()
+        await stop_webhook()
         log_action("shutdown", "API stopped", "SYSTEM", "info")
         logger.info("Shutdown complete")
 
@@ -127,6 +136,22 @@ async def health_check():
     return {"status": "operational", "version": "2.0.0"}
 
 
+@app.post("/telegram/webhook")
+async def telegram_webhook(request: Request):
+    """Receive pushed Telegram updates (active when TELEGRAM_WEBHOOK_URL is set)."""
+    if not is_webhook_configured():
+        raise HTTPException(status_code=404, detail="Not found")
+
+    secret = request.headers.get("x-telegram-bot-api-secret-token", "")
+    if not verify_webhook_secret(secret):
+        log_action("auth_failed", "Invalid webhook secret token", "SECURITY", "warning")
+        raise HTTPException(status_code=401, detail="Invalid secret token")
+
+    data = await request.json()
+    await process_webhook_update(data)
+    return {"status": "ok"}
+
+
 @app.get("/plugins")
 async def get_available_plugins(authenticated: bool = Depends(verify_static_token)):
     """List available target plugins."""
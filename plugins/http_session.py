@@ -0,0 +1,15 @@
+"""Shared HTTP session for API plugins.
+
+A single module-level requests.Session with a sized connection pool lets
+repeated monitoring probes and shutdown calls reuse kept-alive TLS
+connections instead of paying a fresh TCP + TLS handshake per request.
+The session is safe to share across the monitoring threads.
+"""
+import requests
+from requests.adapters import HTTPAdapter
+
+_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10)
+
+session = requests.Session()
+session.mount("https://", _adapter)
+session.mount("http://", _adapter)
@@ -2,6 +2,7 @@ import logging
 import requests
 from typing import Dict, Any
 from plugins.base import PluginBase
+from plugins.http_session import session
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +19,7 @@ class ProxmoxPlugin(PluginBase):
         api_key = config.get("api_key", "")
         
         try:
-            response = requests.get(
+            response = session.get(
                 f"https://{host}:8006/api2/json/version",
                 headers={"Authorization": f"PVEAPIToken={api_key}"},
                 verify=False,
@@ -45,7 +46,7 @@ class ProxmoxPlugin(PluginBase):
         result = {"host": host, "status": "unknown", "details": ""}
         
         try:
-            response = requests.post(
+            response = session.post(
                 f"https://{host}:8006/api2/json/nodes/{node}/status",
                 headers={"Authorization": f"PVEAPIToken={api_key}"},
                 json={"command": "shutdown"},
@@ -2,6 +2,7 @@ import logging
 import requests
 from typing import Dict, Any
 from plugins.base import PluginBase
+from plugins.http_session import session
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +19,7 @@ class TrueNASPlugin(PluginBase):
         api_key = config.get("api_key", "")
         
         try:
-            response = requests.get(
+            response = session.get(
                 f"https://{host}/api/v2.0/system/info",
                 headers={"Authorization": f"Bearer {api_key}"},
                 verify=False,
@@ -44,7 +45,7 @@ class TrueNASPlugin(PluginBase):
         result = {"host": host, "status": "unknown", "details": ""}
         
         try:
-            response = requests.post(
+            response = session.post(
                 f"https://{host}/api/v2.0/system/shutdown",
                 headers={"Authorization": f"Bearer {api_key}"},
                 json={"delay": 0},
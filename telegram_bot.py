@@ -1,6 +1,17 @@
+import asyncio
+import atexit
 import logging
 import os
-from typing import Dict, Any, Set
+import re
+import secrets
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, Set, Optional
+
+from cachetools import TTLCache
 
 logger = logging.getLogger(__name__)
 
@@ -20,86 +31,435 @@ httpcore_logger.setLevel(logging.WARNING)
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "")
 
+# Optional webhook mode: when a public HTTPS URL is configured Telegram pushes
+# updates to the API instead of the bot long-polling getUpdates, cutting idle
+# network chatter and per-update latency. Polling remains the default since a
+# webhook needs a reachable URL.
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "") or secrets.token_urlsafe(32)
+
+# Parse the authorized chat id once so handlers compare integers instead of
+# paying a str() allocation and string compare on every update
+try:
+    _AUTH_USER_ID = int(TELEGRAM_CHAT_ID)
+except ValueError:
+    _AUTH_USER_ID = None
+
+
+def _is_authorized(user_id: int) -> bool:
+    return _AUTH_USER_ID is not None and user_id == _AUTH_USER_ID
+
+
+try:
+    from telegram.error import RetryAfter, BadRequest, Forbidden
+except ImportError:
+    class RetryAfter(Exception):
+        """Fallback so the notifier path compiles when telegram is absent."""
+        retry_after = 0
+
+    class BadRequest(Exception):
+        pass
+
+    class Forbidden(Exception):
+        pass
+
+try:
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+except ImportError:
+    InlineKeyboardButton = InlineKeyboardMarkup = None
+
+# Keyboards never change between calls, so build each once at import time
+# instead of re-allocating buttons/markup on every callback
+if InlineKeyboardMarkup is not None:
+    _BACK_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="back")]])
+    _BACK_MENU_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back to Menu", callback_data="back")]])
+    _UNAUTH_MENU_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🔐 Login", callback_data="login")]])
+    _AUTH_MENU_MARKUP = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📊 System Status", callback_data="status")],
+        [InlineKeyboardButton("📜 View Logs", callback_data="view_logs")],
+        [InlineKeyboardButton("📋 List SSH Hosts", callback_data="list_ssh")],
+        [InlineKeyboardButton("📋 List API Hosts", callback_data="list_api")],
+        [InlineKeyboardButton("➕ Add SSH Host", callback_data="add_ssh")],
+        [InlineKeyboardButton("➕ Add API Host", callback_data="add_api")],
+        [InlineKeyboardButton("🗑️ Remove SSH Host", callback_data="remove_ssh")],
+        [InlineKeyboardButton("🗑️ Remove API Host", callback_data="remove_api")],
+        [InlineKeyboardButton("🔴 Emergency Shutdown (All)", callback_data="shutdown")],
+        [InlineKeyboardButton("⚡ Selective Shutdown", callback_data="selective_shutdown")],
+        [InlineKeyboardButton("🔓 Logout", callback_data="logout")]
+    ])
+else:
+    _BACK_MARKUP = _BACK_MENU_MARKUP = _UNAUTH_MENU_MARKUP = _AUTH_MENU_MARKUP = None
+
+# Core modules are always importable; binding these once keeps the
+# IMPORT_NAME/IMPORT_FROM bytecode out of every handler invocation
+from database import (
+    is_telegram_session_valid, add_telegram_session, remove_telegram_session,
+    get_all_ssh_hosts, get_all_api_hosts, get_all_logs,
+    get_ssh_host, get_api_host,
+    add_ssh_host, add_api_host, delete_ssh_host, delete_api_host
+)
+from dms_logic import (
+    is_shutdown_in_progress, get_shutdown_status, initiate_hard_poweroff,
+    execute_shutdown_phase, test_ssh_connection, test_api_connection,
+    monitor_ssh_host, monitor_api_host
+)
+from auth import verify_static_token_value, verify_totp, get_ssh_public_key
+from plugins import list_plugins
+
 _telegram_enabled = False
 _bot = None
-_pending_auth: Dict[int, str] = {}
-_pending_operations: Dict[int, Dict[str, Any]] = {}
+# Set when running in webhook mode; updates are fed in via process_webhook_update
+_application = None
+# Bounded with a TTL so abandoned login/OTP flows expire instead of
+# accumulating forever; dict-style access (in/[]/del) works unchanged
+_pending_auth: TTLCache = TTLCache(maxsize=1024, ttl=300)
+_pending_operations: TTLCache = TTLCache(maxsize=1024, ttl=600)
+
+# Every update pays a DB query for the session check; cache positive
+# answers briefly. Only True is cached, so a fresh login is visible
+# immediately and logout just drops the entry below.
+_valid_sessions: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+
+
+def _session_valid(user_id: int) -> bool:
+    """TTL-cached wrapper around is_telegram_session_valid."""
+    if user_id in _valid_sessions:
+        return True
+    if is_telegram_session_valid(user_id):
+        _valid_sessions[user_id] = True
+        return True
+    return False
+
+# TOTP verification hits pyotp + the log table, so it runs in a worker
+# thread instead of blocking the event loop. Attempts are counted per
+# user in a 60s window to bound brute-force guessing.
+_OTP_ATTEMPT_LIMIT = 5
+_otp_attempts: TTLCache = TTLCache(maxsize=1024, ttl=60)
+
+
+async def _check_totp(user_id: int, code: str) -> Optional[bool]:
+    """Verify a TOTP code off the event loop, rate-limited per user.
+
+    Returns True on success, False for a bad code, and None when the
+    attempt window is exhausted — callers should keep their pending
+    state so the user can retry once the window expires.
+    """
+    attempts = _otp_attempts.get(user_id, 0)
+    if attempts >= _OTP_ATTEMPT_LIMIT:
+        logger.warning("TOTP rate limit hit for user %s", user_id)
+        return None
+    _otp_attempts[user_id] = attempts + 1
+    if await asyncio.to_thread(verify_totp, code):
+        _otp_attempts.pop(user_id, None)
+        return True
+    return False
+
+# Shared event loop for sync-invoked notifications. Creating a fresh loop per
+# message pays full setup/teardown (selector, SSL context, connection pool) on
+# every call; a single daemon-thread loop lets the bot's httpx client reuse
+# its connections across notifications.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared notifier event loop, starting its thread on first use."""
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, daemon=True)
+            _loop_thread.start()
+            atexit.register(_loop.call_soon_threadsafe, _loop.stop)
+    return _loop
+
+
+class _TokenBucket:
+    """Minimal async token bucket used to stay under Telegram's rate limits."""
+
+    def __init__(self, rate: float, capacity: float):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+# Telegram allows ~30 msg/s overall and 1 msg/s per chat; bursts beyond that
+# earn HTTP 429 with a retry-after penalty far costlier than waiting here.
+_global_bucket = _TokenBucket(rate=30, capacity=30)
+_chat_buckets: Dict[str, _TokenBucket] = defaultdict(lambda: _TokenBucket(rate=1, capacity=1))
+
+
+async def _throttle(chat_id: str):
+    """Wait until a message may be sent to chat_id without tripping limits."""
+    await _global_bucket.acquire()
+    await _chat_buckets[chat_id].acquire()
+
+
+# Matches "3" or "1-4" tokens in a selective-shutdown selection
+_SELECTION_RE = re.compile(r'(\d+)\s*(?:-\s*(\d+))?')
+
+# Characters that trigger Telegram's Markdown parser. Plain payloads skip
+# parse_mode so dynamic text (error strings, hostnames) can never fail with
+# "can't parse entities"; messages built with intentional formatting keep
+# passing parse_mode="Markdown" explicitly.
+_MD_CHARS = frozenset("*_`[")
+
+
+def _pm(text: str) -> Optional[str]:
+    """Return "Markdown" when text contains formatting characters, else None."""
+    return "Markdown" if any(c in _MD_CHARS for c in text) else None
+
+
+# Per-host shutdown result classification; constant lookups replace the
+# if/elif chains and per-iteration list literals in the report loops
+_STATUS_ICON = {"shutdown_initiated": "✅", "executed": "✅", "timeout": "⏱️"}
+_SUCCESS_STATUSES = frozenset(_STATUS_ICON)  # timeout usually means the host went down
+_CLEAN_STATUSES = frozenset({"shutdown_initiated", "executed"})  # no details shown
+
+# Rapid menu taps re-issue the same host queries; a short TTL keeps them off
+# the DB while monitoring updates still show up within a few seconds
+_HOST_CACHE_TTL = 3.0
+_host_cache: Dict[tuple, tuple] = {}
+
+
+def _cached_ssh_hosts(enabled_only: bool = True):
+    """TTL-cached wrapper around get_all_ssh_hosts for handler hot paths."""
+    key = ("ssh", enabled_only)
+    entry = _host_cache.get(key)
+    now = time.monotonic()
+    if entry and now - entry[0] < _HOST_CACHE_TTL:
+        return entry[1]
+    hosts = get_all_ssh_hosts(enabled_only=enabled_only)
+    _host_cache[key] = (now, hosts)
+    return hosts
+
+
+def _cached_api_hosts(enabled_only: bool = True):
+    """TTL-cached wrapper around get_all_api_hosts for handler hot paths."""
+    key = ("api", enabled_only)
+    entry = _host_cache.get(key)
+    now = time.monotonic()
+    if entry and now - entry[0] < _HOST_CACHE_TTL:
+        return entry[1]
+    hosts = get_all_api_hosts(enabled_only=enabled_only)
+    _host_cache[key] = (now, hosts)
+    return hosts
+
+
+def _invalidate_host_cache():
+    """Drop cached host lists after an add/remove so reads see the change."""
+    _host_cache.clear()
+
 
 try:
     if TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID:
         from telegram import Bot
-        
+        from telegram.request import HTTPXRequest
+
         logger.info("Telegram configuration found")
-        logger.info(f"Bot token length: {len(TELEGRAM_BOT_TOKEN)} chars")
-        logger.info(f"Chat ID configured: {TELEGRAM_CHAT_ID[:3]}...")
-        
-        _bot = Bot(token=TELEGRAM_BOT_TOKEN)
+        logger.info("Bot token length: %d chars", len(TELEGRAM_BOT_TOKEN))
+        logger.info("Chat ID configured: %s...", TELEGRAM_CHAT_ID[:3])
+
+        # Pooled client so concurrent notifications reuse kept-alive
+        # connections instead of queueing on the default single-slot pool
+        _bot = Bot(token=TELEGRAM_BOT_TOKEN, request=HTTPXRequest(connection_pool_size=8))
         _telegram_enabled = True
         logger.info("Telegram bot client initialized successfully")
     else:
-        missing = []
-        if not TELEGRAM_BOT_TOKEN:
-            missing.append("TELEGRAM_BOT_TOKEN")
-        if not TELEGRAM_CHAT_ID:
-            missing.append("TELEGRAM_CHAT_ID")
-        logger.info(f"Telegram not configured. Missing: {', '.join(missing)}")
+        missing = ", ".join(
+            name for name, value in (("TELEGRAM_BOT_TOKEN", TELEGRAM_BOT_TOKEN),
+                                     ("TELEGRAM_CHAT_ID", TELEGRAM_CHAT_ID))
+            if not value
+        )
+        logger.info("Telegram not configured. Missing: %s", missing)
 except ImportError:
     logger.warning("python-telegram-bot not installed. Install with: pip install python-telegram-bot")
 except Exception as e:
-    logger.error(f"Telegram init failed: {e}")
+    logger.error("Telegram init failed: %s", e)
+
+
+# Short dedup window: repeated identical notifications (e.g. a flapping
+# monitor probe) collapse to one message instead of spamming the chat and
+# burning rate-limit budget. Critical and info variants dedup separately.
+_recent_sends: TTLCache = TTLCache(maxsize=128, ttl=30)
 
 
 def _send_message(message: str, critical: bool = False):
     """Send simple notification message."""
     if not _telegram_enabled or not _bot:
         return
-    
+
+    dedup_key = hash((critical, message))
+    if dedup_key in _recent_sends:
+        return
+    _recent_sends[dedup_key] = True
+
     try:
-        import asyncio
-        
         prefix = "🚨 CRITICAL" if critical else "ℹ️ INFO"
-        
+        text = f"{prefix}\n\n{message}"
+        parse_mode = _pm(text)
+
         async def send():
-            await _bot.send_message(
-                chat_id=TELEGRAM_CHAT_ID,
-                text=f"{prefix}\n\n{message}",
-                parse_mode="Markdown"
-            )
-        
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(send())
-        loop.close()
-        
+            await _throttle(TELEGRAM_CHAT_ID)
+            try:
+                await _bot.send_message(
+                    chat_id=TELEGRAM_CHAT_ID,
+                    text=text,
+                    parse_mode=parse_mode
+                )
+            except RetryAfter as e:
+                # Server-side rate limit hit anyway; honor it once, then retry
+                await asyncio.sleep(e.retry_after)
+                await _bot.send_message(
+                    chat_id=TELEGRAM_CHAT_ID,
+                    text=text,
+                    parse_mode=parse_mode
+                )
+
+        asyncio.run_coroutine_threadsafe(send(), _get_loop()).result(timeout=10)
+
     except Exception as e:
-        logger.error(f"Send message failed: {e}")
+        logger.error("Send message failed: %s", e)
+
+
+def _offline_row(label: str, h: Dict[str, Any]) -> str:
+    """Format one offline-host row for the status report."""
+    row = f"❌ {label}\n   Status: {h.get('last_status', 'unknown')}\n"
+    if h.get('last_error'):
+        row += f"   Error: {h['last_error'][:50]}\n"
+    return row
+
+
+def _render_status():
+    """Build the status panel shared by /status and the status button.
+
+    Returns (text, reply_markup).
+    """
+    parts = ["📊 **System Status**\n\n"]
+
+    if is_shutdown_in_progress():
+        status = get_shutdown_status()
+        parts.append("⚠️ **SHUTDOWN IN PROGRESS**\n")
+        parts.append(f"Phase: {status.get('phase', 'unknown')}\n")
+        parts.append(f"Started: {status.get('started_at', 'N/A')}\n\n")
+    else:
+        parts.append("✅ **System Operational**\n\n")
+
+    ssh_hosts = _cached_ssh_hosts(enabled_only=False)
+    api_hosts = _cached_api_hosts(enabled_only=False)
+
+    # Single fused pass per host list: count every bucket and collect
+    # the offline rows for the report in one traversal
+    ssh_online = ssh_offline = ssh_disabled = 0
+    ssh_offline_rows = []
+    for h in ssh_hosts:
+        if not h['enabled']:
+            ssh_disabled += 1
+        elif h.get('last_status') == 'online':
+            ssh_online += 1
+        else:
+            ssh_offline += 1
+            ssh_offline_rows.append(h)
+
+    api_online = api_offline = api_disabled = 0
+    api_offline_rows = []
+    for h in api_hosts:
+        if not h['enabled']:
+            api_disabled += 1
+        elif h.get('last_status') == 'online':
+            api_online += 1
+        else:
+            api_offline += 1
+            api_offline_rows.append(h)
+
+    parts.append(f"**SSH Hosts ({len(ssh_hosts)} total)**\n")
+    parts.append(f"✅ Online: {ssh_online}\n")
+    if ssh_offline > 0:
+        parts.append(f"❌ Offline: {ssh_offline}\n")
+    if ssh_disabled > 0:
+        parts.append(f"⏸️ Disabled: {ssh_disabled}\n")
+    parts.append("\n")
+
+    parts.append(f"**API Hosts ({len(api_hosts)} total)**\n")
+    parts.append(f"✅ Online: {api_online}\n")
+    if api_offline > 0:
+        parts.append(f"❌ Offline: {api_offline}\n")
+    if api_disabled > 0:
+        parts.append(f"⏸️ Disabled: {api_disabled}\n")
+    parts.append("\n")
+
+    if ssh_offline_rows or api_offline_rows:
+        # Single join over a generator: no intermediate per-row list
+        parts.append("⚠️ **Offline Hosts:**\n")
+        parts.append("".join(_offline_row(f"`{h['user']}@{h['host']}`", h) for h in ssh_offline_rows))
+        parts.append("".join(_offline_row(f"`{h['host']}` ({h['api_type']})", h) for h in api_offline_rows))
+
+    return "".join(parts), _BACK_MARKUP
+
+
+def _render_ssh_list():
+    """Build the SSH host list view. Returns (text, reply_markup)."""
+    hosts = _cached_ssh_hosts(enabled_only=False)
+
+    if not hosts:
+        return "📋 SSH Hosts\n\nNo hosts configured.", _BACK_MARKUP
+
+    shown = hosts[:10]
+    extra = len(hosts) - len(shown)
+
+    parts = ["📋 SSH Hosts\n\n"]
+    for h in shown:
+        status_icon = "✅" if h["enabled"] else "⏸️"
+        parts.append(f"{status_icon} `{h['user']}@{h['host']}`\n")
+        parts.append(f"   Status: {h.get('last_status', 'unknown')}\n\n")
+    if extra:
+        parts.append(f"\n...and {extra} more")
+    return "".join(parts), _BACK_MARKUP
+
+
+def _render_api_list():
+    """Build the API host list view. Returns (text, reply_markup)."""
+    hosts = _cached_api_hosts(enabled_only=False)
+
+    if not hosts:
+        return "📋 API Hosts\n\nNo hosts configured.", _BACK_MARKUP
+
+    shown = hosts[:10]
+    extra = len(hosts) - len(shown)
+
+    parts = ["📋 API Hosts\n\n"]
+    for h in shown:
+        status_icon = "✅" if h["enabled"] else "⏸️"
+        parts.append(f"{status_icon} `{h['host']}` ({h['api_type']})\n")
+        parts.append(f"   Status: {h.get('last_status', 'unknown')}\n\n")
+    if extra:
+        parts.append(f"\n...and {extra} more")
+    return "".join(parts), _BACK_MARKUP
 
 
 async def _show_main_menu(update: Any, authenticated: bool = False):
     """Show main menu with available commands."""
-    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-    
     if authenticated:
-        keyboard = [
-            [InlineKeyboardButton("📊 System Status", callback_data="status")],
-            [InlineKeyboardButton("📜 View Logs", callback_data="view_logs")],
-            [InlineKeyboardButton("📋 List SSH Hosts", callback_data="list_ssh")],
-            [InlineKeyboardButton("📋 List API Hosts", callback_data="list_api")],
-            [InlineKeyboardButton("➕ Add SSH Host", callback_data="add_ssh")],
-            [InlineKeyboardButton("➕ Add API Host", callback_data="add_api")],
-            [InlineKeyboardButton("🗑️ Remove SSH Host", callback_data="remove_ssh")],
-            [InlineKeyboardButton("🗑️ Remove API Host", callback_data="remove_api")],
-            [InlineKeyboardButton("🔴 Emergency Shutdown (All)", callback_data="shutdown")],
-            [InlineKeyboardButton("⚡ Selective Shutdown", callback_data="selective_shutdown")],
-            [InlineKeyboardButton("🔓 Logout", callback_data="logout")]
-        ]
         text = "🛡️ Control Panel (Authenticated)\n\nSelect an operation:"
+        reply_markup = _AUTH_MENU_MARKUP
     else:
-        keyboard = [[InlineKeyboardButton("🔐 Login", callback_data="login")]]
         text = "🛡️ Dead Man's Switch\n\nAuthenticate to access control panel."
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
+        reply_markup = _UNAUTH_MENU_MARKUP
+
     if hasattr(update, 'callback_query') and update.callback_query:
         try:
             await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
@@ -114,50 +474,25 @@ async def _cmd_start(update: Any, context: Any):
     """Handle /start command."""
     user_id = update.effective_user.id
     
-    if str(user_id) != TELEGRAM_CHAT_ID:
+    if not _is_authorized(user_id):
         await update.message.reply_text("⛔ Unauthorized")
-        logger.warning(f"Unauthorized /start from user {user_id}")
+        logger.warning("Unauthorized /start from user %s", user_id)
         return
     
-    from database import is_telegram_session_valid
-    authenticated = is_telegram_session_valid(user_id)
+    authenticated = _session_valid(user_id)
     await _show_main_menu(update, authenticated)
 
 
 async def _cmd_status(update: Any, context: Any):
     user_id = update.effective_user.id
     
-    if str(user_id) != TELEGRAM_CHAT_ID:
+    if not _is_authorized(user_id):
         await update.message.reply_text("⛔ Unauthorized")
         return
     
     try:
-        from database import get_all_ssh_hosts, get_all_api_hosts
-        from dms_logic import is_shutdown_in_progress, get_shutdown_status
-        
-        text = "📊 **System Status**\n\n"
-        
-        if is_shutdown_in_progress():
-            status = get_shutdown_status()
-            text += f"⚠️ **SHUTDOWN IN PROGRESS**\n"
-            text += f"Phase: {status.get('phase', 'unknown')}\n"
-            text += f"Started: {status.get('started_at', 'N/A')}\n\n"
-        else:
-            text += "✅ **System Operational**\n\n"
-        
-        ssh_hosts = get_all_ssh_hosts(enabled_only=False)
-        api_hosts = get_all_api_hosts(enabled_only=False)
-        
-        ssh_online = sum(1 for h in ssh_hosts if h.get('last_status') == 'online' and h['enabled'])
-        ssh_total = sum(1 for h in ssh_hosts if h['enabled'])
-        
-        api_online = sum(1 for h in api_hosts if h.get('last_status') == 'online' and h['enabled'])
-        api_total = sum(1 for h in api_hosts if h['enabled'])
-        
-        text += f"**SSH:** {ssh_online}/{ssh_total} online\n"
-        text += f"**API:** {api_online}/{api_total} online\n"
-        
-        await update.message.reply_text(text, parse_mode="Markdown")
+        text, reply_markup = _render_status()
+        await update.message.reply_text(text, parse_mode="Markdown", reply_markup=reply_markup)
     except Exception as e:
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
@@ -165,593 +500,592 @@ async def _cmd_status(update: Any, context: Any):
 async def _cmd_logout(update: Any, context: Any):
     user_id = update.effective_user.id
     
-    from database import remove_telegram_session, is_telegram_session_valid
     
-    if is_telegram_session_valid(user_id):
+    if _session_valid(user_id):
+        _valid_sessions.pop(user_id, None)
         remove_telegram_session(user_id)
         await update.message.reply_text("✅ Logged out")
-        logger.info(f"User {user_id} logged out")
+        logger.info("User %s logged out", user_id)
     else:
         await update.message.reply_text("ℹ️ Not authenticated")
 
 
+async def _h_login(update: Any, query: Any, user_id: int):
+    """Begin the two-step login flow."""
+    # Remember the prompt message so later steps can edit it in place
+    # instead of sending a fresh message per transition
+    _pending_auth[user_id] = {
+        "state": "awaiting_token",
+        "msg_id": query.message.message_id if query.message else None
+    }
+    await query.edit_message_text(
+        "🔐 Authentication (Step 1/2)\n\n"
+        "Send your API static token.\n\n"
+        "Note: TOTP code will be required next."
+    )
+
+
+async def _h_back(update: Any, query: Any, user_id: int):
+    """Return to the main menu, clearing any pending operation."""
+    # Clear any pending operations to avoid stale state
+    _pending_operations.pop(user_id, None)
+    await _show_main_menu(update, True)
+
+
+async def _h_logout(update: Any, query: Any, user_id: int):
+    """End the session and show the unauthenticated menu."""
+    if _session_valid(user_id):
+        _valid_sessions.pop(user_id, None)
+        remove_telegram_session(user_id)
+        logger.info("User %s logged out", user_id)
+    await _show_main_menu(update, False)
+
+
+async def _h_status(update: Any, query: Any, user_id: int):
+    """Show the system status panel."""
+    try:
+        text, reply_markup = _render_status()
+        await query.edit_message_text(text, parse_mode="Markdown", reply_markup=reply_markup)
+    except Exception as e:
+        await query.edit_message_text(f"❌ Error: {str(e)}")
+
+
+async def _h_view_logs(update: Any, query: Any, user_id: int):
+    """Show recent audit log entries."""
+    try:
+        logs = get_all_logs(limit=20)
+
+        if not logs:
+            reply_markup = _BACK_MARKUP
+            await query.edit_message_text("📜 No logs available.", reply_markup=reply_markup)
+            return
+
+        parts = ["📜 <b>Recent Activity Logs</b>\n", f"<i>Showing last {len(logs)} entries</i>\n\n"]
+
+        # Status icons
+        status_icons = {
+            "info": "ℹ️",
+            "warning": "⚠️",
+            "error": "❌",
+            "critical": "🚨",
+            "success": "✅"
+        }
+
+        for log in logs:
+            timestamp = log.get("timestamp", "")
+            action = log.get("action", "unknown")
+            details = log.get("details", "")
+            source = log.get("source", "")
+            status = log.get("status", "info")
+
+            icon = status_icons.get(status, "•")
+
+            # Format timestamp (keep only time if today)
+            try:
+                dt = datetime.fromisoformat(timestamp)
+                time_str = dt.strftime("%H:%M:%S")
+            except (TypeError, ValueError):
+                time_str = timestamp[:19] if len(timestamp) > 19 else timestamp
+
+            # Escape HTML
+            action_safe = action.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            details_safe = details.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            source_safe = source.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+            parts.append(f"{icon} <code>{time_str}</code>\n")
+            parts.append(f"   <b>{action_safe}</b>")
+            if source_safe:
+                parts.append(f" <i>({source_safe})</i>")
+            parts.append("\n")
+            if details_safe:
+                # Truncate long details
+                if len(details_safe) > 60:
+                    details_safe = details_safe[:57] + "..."
+                parts.append(f"   {details_safe}\n")
+            parts.append("\n")
+
+        reply_markup = _BACK_MARKUP
+        await query.edit_message_text("".join(parts), parse_mode="HTML", reply_markup=reply_markup)
+    except Exception as e:
+        await query.edit_message_text(f"❌ Error: {str(e)}")
+
+
+async def _h_list_ssh(update: Any, query: Any, user_id: int):
+    """Show the SSH host list."""
+    try:
+        text, reply_markup = _render_ssh_list()
+        await query.edit_message_text(text, parse_mode="Markdown", reply_markup=reply_markup)
+    except Exception as e:
+        await query.edit_message_text(f"❌ Error: {str(e)}")
+
+
+async def _h_list_api(update: Any, query: Any, user_id: int):
+    """Show the API host list."""
+    try:
+        text, reply_markup = _render_api_list()
+        await query.edit_message_text(text, parse_mode="Markdown", reply_markup=reply_markup)
+    except Exception as e:
+        await query.edit_message_text(f"❌ Error: {str(e)}")
+
+
+async def _h_add_ssh(update: Any, query: Any, user_id: int):
+    """Prompt for SSH host details."""
+    public_key = get_ssh_public_key()
+
+    reply_markup = _BACK_MARKUP
+
+    text = (
+        "➕ Add SSH Host\n\n"
+        "Send details in this format:\n"
+        "`ssh:hostname:username::description`\n\n"
+        "Example:\n"
+        "`ssh:server.local:root::Production server`\n\n"
+    )
+
+    if public_key:
+        text += f"🔑 **Public Key** (add to target `~/.ssh/authorized_keys`):\n`{public_key}`\n\n"
+
+    text += (
+        "⚠️ **Required on target host:**\n"
+        "Add to `/etc/sudoers.d/dms-shutdown`:\n"
+        "`username ALL=(ALL) NOPASSWD: /sbin/shutdown`\n\n"
+        "Or if no sudoers support, configure SSH as root user.\n\n"
+        "TOTP code will be required after connection test."
+    )
+
+    await query.edit_message_text(
+        text,
+        parse_mode="Markdown",
+        reply_markup=reply_markup
+    )
+
+
+async def _h_add_api(update: Any, query: Any, user_id: int):
+    """Prompt for API host details."""
+    reply_markup = _BACK_MARKUP
+    await query.edit_message_text(
+        "➕ Add API Host\n\n"
+        "Send details in this format:\n"
+        "`api:type:hostname:api_key:api_endpoint:description`\n\n"
+        "If any field contains colons, you can use `|` as delimiter:\n"
+        "`api|type|hostname|api_key|api_endpoint|description`\n\n"
+        "Example:\n"
+        "`api:vcenter:vcenter.local:admin@vsphere.local:password:vCenter`\n\n"
+        "⚠️ TOTP code will be required after connection test.",
+        parse_mode="Markdown",
+        reply_markup=reply_markup
+    )
+
+
+async def _h_remove_ssh(update: Any, query: Any, user_id: int):
+    """Prompt for which SSH host to remove."""
+    # Clear any pending operations to avoid stale state
+    _pending_operations.pop(user_id, None)
+    try:
+        hosts = _cached_ssh_hosts(enabled_only=False)
+
+        if not hosts:
+            reply_markup = _BACK_MARKUP
+            await query.edit_message_text("📋 No SSH hosts to remove.", reply_markup=reply_markup)
+            return
+
+        parts = ["🗑️ Remove SSH Host\n\nSend the host to remove:\n`host:user`\n\n"]
+        shown = hosts[:10]
+        extra = len(hosts) - len(shown)
+        for h in shown:
+            parts.append(f"• `{h['host']}:{h['user']}`\n")
+        if extra:
+            parts.append(f"\n...and {extra} more")
+
+        parts.append("\n⚠️ TOTP code will be required.")
+        text = "".join(parts)
+
+        reply_markup = _BACK_MARKUP
+        await query.edit_message_text(text, parse_mode="Markdown", reply_markup=reply_markup)
+    except Exception as e:
+        await query.edit_message_text(f"❌ Error: {str(e)}")
+
+
+async def _h_remove_api(update: Any, query: Any, user_id: int):
+    """Prompt for which API host to remove."""
+    # Clear any pending operations to avoid stale state
+    _pending_operations.pop(user_id, None)
+    try:
+        hosts = _cached_api_hosts(enabled_only=False)
+
+        if not hosts:
+            reply_markup = _BACK_MARKUP
+            await query.edit_message_text("📋 No API hosts to remove.", reply_markup=reply_markup)
+            return
+
+        parts = ["🗑️ Remove API Host\n\nSend the hostname to remove:\n\n"]
+        shown = hosts[:10]
+        extra = len(hosts) - len(shown)
+        for h in shown:
+            parts.append(f"• `{h['host']}`\n")
+        if extra:
+            parts.append(f"\n...and {extra} more")
+
+        parts.append("\n⚠️ TOTP code will be required.")
+        text = "".join(parts)
+
+        reply_markup = _BACK_MARKUP
+        await query.edit_message_text(text, parse_mode="Markdown", reply_markup=reply_markup)
+    except Exception as e:
+        await query.edit_message_text(f"❌ Error: {str(e)}")
+
+
+async def _h_shutdown(update: Any, query: Any, user_id: int):
+    """Arm the emergency shutdown and ask for TOTP confirmation."""
+    _pending_operations[user_id] = {"operation": "shutdown", "state": "awaiting_otp"}
+
+    reply_markup = _BACK_MARKUP
+
+    await query.edit_message_text(
+        "🚨 EMERGENCY SHUTDOWN (ALL HOSTS)\n\n"
+        "⚠️ This will shutdown ALL infrastructure!\n\n"
+        "Send your TOTP code to confirm.",
+        reply_markup=reply_markup
+    )
+
+
+async def _h_selective_shutdown(update: Any, query: Any, user_id: int):
+    """List hosts and ask which to shut down."""
+    try:
+        ssh_hosts = _cached_ssh_hosts(enabled_only=True)
+        api_hosts = _cached_api_hosts(enabled_only=True)
+
+        if not ssh_hosts and not api_hosts:
+            reply_markup = _BACK_MARKUP
+            await query.edit_message_text(
+                "📋 No hosts available for shutdown.",
+                reply_markup=reply_markup
+            )
+            return
+
+        parts = [
+            "⚡ **Selective Shutdown**\n\nChoose hosts to shutdown:\n\n",
+            "Send host identifiers (comma-separated):\n\n"
+        ]
+
+        host_list = []
+        if ssh_hosts:
+            parts.append("**SSH Hosts:**\n")
+            for idx, h in enumerate(ssh_hosts, 1):
+                host_id = f"ssh:{h['host']}:{h['user']}"
+                host_list.append(host_id)
+                parts.append(f"{idx}. `{h['user']}@{h['host']}`\n")
+            parts.append("\n")
+
+        if api_hosts:
+            parts.append("**API Hosts:**\n")
+            offset = len(ssh_hosts)
+            for idx, h in enumerate(api_hosts, offset + 1):
+                host_id = f"api:{h['host']}:{h['api_type']}"
+                host_list.append(host_id)
+                parts.append(f"{idx}. `{h['host']}` ({h['api_type']})\n")
+            parts.append("\n")
+
+        parts.append("\nExamples:\n")
+        parts.append("`1,3,5` to shutdown hosts 1, 3, and 5\n")
+        parts.append("`1-4` to shutdown hosts 1 through 4\n")
+        parts.append("`all` to shutdown all hosts\n")
+        text = "".join(parts)
+
+        _pending_operations[user_id] = {
+            "operation": "selective_shutdown",
+            "state": "awaiting_selection",
+            "host_list": host_list
+        }
+
+        reply_markup = _BACK_MARKUP
+        await query.edit_message_text(text, parse_mode="Markdown", reply_markup=reply_markup)
+    except Exception as e:
+        await query.edit_message_text(f"❌ Error: {str(e)}")
+
+
+# Callback dispatch tables: one dict probe instead of walking an if/elif
+# chain per button press. Entries in _CB_PUBLIC run before the session
+# check; everything else requires a valid session.
+_CB_PUBLIC = {
+    "login": _h_login,
+    "back": _h_back,
+    "logout": _h_logout,
+}
+
+_CB_AUTHENTICATED = {
+    "status": _h_status,
+    "view_logs": _h_view_logs,
+    "list_ssh": _h_list_ssh,
+    "list_api": _h_list_api,
+    "add_ssh": _h_add_ssh,
+    "add_api": _h_add_api,
+    "remove_ssh": _h_remove_ssh,
+    "remove_api": _h_remove_api,
+    "shutdown": _h_shutdown,
+    "selective_shutdown": _h_selective_shutdown,
+}
+
+
 async def _button_callback(update: Any, context: Any):
-    """Handle button callbacks."""
+    """Handle button callbacks via the dispatch tables."""
     query = update.callback_query
     try:
         await query.answer()
     except Exception:
         pass  # Ignore timeout on answer()
-    
+
     user_id = update.effective_user.id
-    
-    if str(user_id) != TELEGRAM_CHAT_ID:
+
+    if not _is_authorized(user_id):
         await query.edit_message_text("⛔ Unauthorized")
         return
-    
-    from database import is_telegram_session_valid, remove_telegram_session
-    
+
     data = query.data
-    authenticated = is_telegram_session_valid(user_id)
-    
-    if data == "login":
-        _pending_auth[user_id] = "awaiting_token"
-        await query.edit_message_text(
-            "🔐 Authentication (Step 1/2)\n\n"
-            "Send your API static token.\n\n"
-            "Note: TOTP code will be required next."
-        )
-        return
-    
-    if data == "back":
-        # Clear any pending operations to avoid stale state
-        if user_id in _pending_operations:
-            del _pending_operations[user_id]
-        await _show_main_menu(update, True)
-        return
-    
-    if data == "logout":
-        if authenticated:
-            remove_telegram_session(user_id)
-            logger.info(f"User {user_id} logged out")
-        await _show_main_menu(update, False)
+
+    handler = _CB_PUBLIC.get(data)
+    if handler is not None:
+        await handler(update, query, user_id)
         return
-    
-    if not authenticated:
+
+    if not _session_valid(user_id):
         await query.edit_message_text("⛔ Please login first")
         return
-    
-    if data == "status":
-        try:
-            from database import get_all_ssh_hosts, get_all_api_hosts
-            from dms_logic import is_shutdown_in_progress, get_shutdown_status
-            
-            text = "📊 **System Status**\n\n"
-            
-            if is_shutdown_in_progress():
-                status = get_shutdown_status()
-                text += f"⚠️ **SHUTDOWN IN PROGRESS**\n"
-                text += f"Phase: {status.get('phase', 'unknown')}\n"
-                text += f"Started: {status.get('started_at', 'N/A')}\n\n"
-            else:
-                text += "✅ **System Operational**\n\n"
-            
-            ssh_hosts = get_all_ssh_hosts(enabled_only=False)
-            api_hosts = get_all_api_hosts(enabled_only=False)
-            
-            ssh_online = sum(1 for h in ssh_hosts if h.get('last_status') == 'online' and h['enabled'])
-            ssh_offline = sum(1 for h in ssh_hosts if h.get('last_status') != 'online' and h['enabled'])
-            ssh_disabled = sum(1 for h in ssh_hosts if not h['enabled'])
-            
-            api_online = sum(1 for h in api_hosts if h.get('last_status') == 'online' and h['enabled'])
-            api_offline = sum(1 for h in api_hosts if h.get('last_status') != 'online' and h['enabled'])
-            api_disabled = sum(1 for h in api_hosts if not h['enabled'])
-            
-            text += f"**SSH Hosts ({len(ssh_hosts)} total)**\n"
-            text += f"✅ Online: {ssh_online}\n"
-            if ssh_offline > 0:
-                text += f"❌ Offline: {ssh_offline}\n"
-            if ssh_disabled > 0:
-                text += f"⏸️ Disabled: {ssh_disabled}\n"
-            text += "\n"
-            
-            text += f"**API Hosts ({len(api_hosts)} total)**\n"
-            text += f"✅ Online: {api_online}\n"
-            if api_offline > 0:
-                text += f"❌ Offline: {api_offline}\n"
-            if api_disabled > 0:
-                text += f"⏸️ Disabled: {api_disabled}\n"
-            text += "\n"
-            
-            if ssh_offline > 0 or api_offline > 0:
-                text += "⚠️ **Offline Hosts:**\n"
-                for h in ssh_hosts:
-                    if h['enabled'] and h.get('last_status') != 'online':
-                        status_icon = "❌"
-                        text += f"{status_icon} `{h['user']}@{h['host']}`\n"
-                        text += f"   Status: {h.get('last_status', 'unknown')}\n"
-                        if h.get('last_error'):
-                            error = h['last_error'][:50]
-                            text += f"   Error: {error}\n"
-                
-                for h in api_hosts:
-                    if h['enabled'] and h.get('last_status') != 'online':
-                        status_icon = "❌"
-                        text += f"{status_icon} `{h['host']}` ({h['api_type']})\n"
-                        text += f"   Status: {h.get('last_status', 'unknown')}\n"
-                        if h.get('last_error'):
-                            error = h['last_error'][:50]
-                            text += f"   Error: {error}\n"
-            
-            from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-            keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text, parse_mode="Markdown", reply_markup=reply_markup)
-        except Exception as e:
-            await query.edit_message_text(f"❌ Error: {str(e)}")
-        return
-    
-    if data == "view_logs":
-        try:
-            from database import get_all_logs
-            logs = get_all_logs(limit=20)
-            
-            if not logs:
-                from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-                keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.edit_message_text("📜 No logs available.", reply_markup=reply_markup)
-                return
-            
-            text = "📜 <b>Recent Activity Logs</b>\n"
-            text += f"<i>Showing last {len(logs)} entries</i>\n\n"
-            
-            # Status icons
-            status_icons = {
-                "info": "ℹ️",
-                "warning": "⚠️",
-                "error": "❌",
-                "critical": "🚨",
-                "success": "✅"
-            }
-            
-            for log in logs:
-                timestamp = log.get("timestamp", "")
-                action = log.get("action", "unknown")
-                details = log.get("details", "")
-                source = log.get("source", "")
-                status = log.get("status", "info")
-                
-                icon = status_icons.get(status, "•")
-                
-                # Format timestamp (keep only time if today)
-                try:
-                    from datetime import datetime
-                    dt = datetime.fromisoformat(timestamp)
-                    time_str = dt.strftime("%H:%M:%S")
-                except:
-                    time_str = timestamp[:19] if len(timestamp) > 19 else timestamp
-                
-                # Escape HTML
-                action_safe = action.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-                details_safe = details.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-                source_safe = source.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-                
-                text += f"{icon} <code>{time_str}</code>\n"
-                text += f"   <b>{action_safe}</b>"
-                if source_safe:
-                    text += f" <i>({source_safe})</i>"
-                text += "\n"
-                if details_safe:
-                    # Truncate long details
-                    if len(details_safe) > 60:
-                        details_safe = details_safe[:57] + "..."
-                    text += f"   {details_safe}\n"
-                text += "\n"
-            
-            from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-            keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text, parse_mode="HTML", reply_markup=reply_markup)
-        except Exception as e:
-            await query.edit_message_text(f"❌ Error: {str(e)}")
-        return
-    
-    if data == "list_ssh":
-        try:
-            from database import get_all_ssh_hosts
-            hosts = get_all_ssh_hosts(enabled_only=False)
-            
-            if not hosts:
-                text = "📋 SSH Hosts\n\nNo hosts configured."
-            else:
-                text = "📋 SSH Hosts\n\n"
-                for h in hosts[:10]:
-                    status_icon = "✅" if h["enabled"] else "⏸️"
-                    text += f"{status_icon} `{h['user']}@{h['host']}`\n"
-                    text += f"   Status: {h.get('last_status', 'unknown')}\n\n"
-                if len(hosts) > 10:
-                    text += f"\n...and {len(hosts)-10} more"
-            
-            from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-            keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text, parse_mode="Markdown", reply_markup=reply_markup)
-        except Exception as e:
-            await query.edit_message_text(f"❌ Error: {str(e)}")
-        return
-    
-    if data == "list_api":
+
+    handler = _CB_AUTHENTICATED.get(data)
+    if handler is not None:
+        await handler(update, query, user_id)
+
+
+async def _update_auth_prompt(update: Any, context: Any, prompt_id: Any, text: str, reply_markup: Any = None):
+    """Edit the login prompt in place; fall back to a reply if editing fails."""
+    if prompt_id:
         try:
-            from database import get_all_api_hosts
-            hosts = get_all_api_hosts(enabled_only=False)
-            
-            if not hosts:
-                text = "📋 API Hosts\n\nNo hosts configured."
-            else:
-                text = "📋 API Hosts\n\n"
-                for h in hosts[:10]:
-                    status_icon = "✅" if h["enabled"] else "⏸️"
-                    text += f"{status_icon} `{h['host']}` ({h['api_type']})\n"
-                    text += f"   Status: {h.get('last_status', 'unknown')}\n\n"
-                if len(hosts) > 10:
-                    text += f"\n...and {len(hosts)-10} more"
-            
-            from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-            keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text, parse_mode="Markdown", reply_markup=reply_markup)
-        except Exception as e:
-            await query.edit_message_text(f"❌ Error: {str(e)}")
-        return
-    
-    if data == "add_ssh":
-        from auth import get_ssh_public_key
-        public_key = get_ssh_public_key()
-        
-        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-        keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        text = (
-            "➕ Add SSH Host\n\n"
-            "Send details in this format:\n"
-            "`ssh:hostname:username::description`\n\n"
-            "Example:\n"
-            "`ssh:server.local:root::Production server`\n\n"
-        )
-        
-        if public_key:
-            text += f"🔑 **Public Key** (add to target `~/.ssh/authorized_keys`):\n`{public_key}`\n\n"
-        
-        text += (
-            "⚠️ **Required on target host:**\n"
-            "Add to `/etc/sudoers.d/dms-shutdown`:\n"
-            "`username ALL=(ALL) NOPASSWD: /sbin/shutdown`\n\n"
-            "Or if no sudoers support, configure SSH as root user.\n\n"
-            "TOTP code will be required after connection test."
-        )
-        
-        await query.edit_message_text(
-            text,
-            parse_mode="Markdown",
-            reply_markup=reply_markup
-        )
-        return
-    
-    if data == "add_api":
-        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-        keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "➕ Add API Host\n\n"
-            "Send details in this format:\n"
-            "`api:type:hostname:api_key:api_endpoint:description`\n\n"
-            "If any field contains colons, you can use `|` as delimiter:\n"
-            "`api|type|hostname|api_key|api_endpoint|description`\n\n"
-            "Example:\n"
-            "`api:vcenter:vcenter.local:admin@vsphere.local:password:vCenter`\n\n"
-            "⚠️ TOTP code will be required after connection test.",
-            parse_mode="Markdown",
-            reply_markup=reply_markup
+            await context.bot.edit_message_text(
+                chat_id=update.effective_chat.id,
+                message_id=prompt_id,
+                text=text,
+                reply_markup=reply_markup
+            )
+            return
+        except Exception:
+            pass  # Prompt too old or already gone; send a new message instead
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+
+async def _delete_and_prompt(message: Any, text: str, **kwargs: Any):
+    """Delete the user's message and send a prompt concurrently.
+
+    A failed delete is expected (no permission, already gone) and only
+    logged; a failed prompt is re-raised so the caller's error path
+    sees it instead of leaving the user waiting with no prompt.
+    """
+    deleted, replied = await asyncio.gather(
+        message.delete(),
+        message.reply_text(text, **kwargs),
+        return_exceptions=True
+    )
+    if isinstance(deleted, (BadRequest, Forbidden)):
+        logger.debug("Message delete failed: %s", deleted)
+    elif isinstance(deleted, BaseException):
+        logger.warning("Message delete failed: %s", deleted)
+    if isinstance(replied, BaseException):
+        raise replied
+
+
+async def _msg_add_ssh(update: Any, user_id: int, message_text: str, delimiter: str):
+    """Handle an `ssh:host:user::description` add request."""
+    try:
+        # Partition chain: each field is peeled off in turn without building
+        # an intermediate list or re-counting segments
+        _, _, rest = message_text.partition(":")
+        host, sep, rest = rest.partition(":")
+        if not sep:
+            await update.message.reply_text("❌ Invalid format. Need: ssh:host:user::description")
+            return
+
+        user, _, rest = rest.partition(":")
+        # command field deprecated; allow empty segment
+        seg, sep, tail = rest.partition(":")
+        description = tail.partition(":")[0] if sep else seg
+
+
+        # Blocking network probe; run it off the event loop so the bot
+        # keeps handling updates while the connection test runs
+        test = await asyncio.to_thread(test_ssh_connection, host, user)
+
+        if not test["success"]:
+            await update.message.reply_text(f"❌ Connection test failed: {test['error']}")
+            return
+
+        _pending_operations[user_id] = {
+            "operation": "add_ssh",
+            "state": "awaiting_otp",
+            "data": {"host": host, "user": user, "description": description}
+        }
+        await _delete_and_prompt(
+            update.message,
+            f"✅ Connection test successful\n\n"
+            f"Send your TOTP code to confirm adding:\n`{user}@{host}`",
+            parse_mode="Markdown"
         )
-        return
-    
-    if data == "remove_ssh":
-        # Clear any pending operations to avoid stale state
-        if user_id in _pending_operations:
-            del _pending_operations[user_id]
-        try:
-            from database import get_all_ssh_hosts
-            hosts = get_all_ssh_hosts(enabled_only=False)
-            
-            if not hosts:
-                from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-                keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.edit_message_text("📋 No SSH hosts to remove.", reply_markup=reply_markup)
-                return
-            
-            text = "🗑️ Remove SSH Host\n\nSend the host to remove:\n`host:user`\n\n"
-            for h in hosts[:10]:
-                text += f"• `{h['host']}:{h['user']}`\n"
-            if len(hosts) > 10:
-                text += f"\n...and {len(hosts)-10} more"
-            
-            text += "\n⚠️ TOTP code will be required."
-            
-            from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-            keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text, parse_mode="Markdown", reply_markup=reply_markup)
-        except Exception as e:
-            await query.edit_message_text(f"❌ Error: {str(e)}")
-        return
-    
-    if data == "remove_api":
-        # Clear any pending operations to avoid stale state
-        if user_id in _pending_operations:
-            del _pending_operations[user_id]
-        try:
-            from database import get_all_api_hosts
-            hosts = get_all_api_hosts(enabled_only=False)
-            
-            if not hosts:
-                from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-                keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.edit_message_text("📋 No API hosts to remove.", reply_markup=reply_markup)
-                return
-            
-            text = "🗑️ Remove API Host\n\nSend the hostname to remove:\n\n"
-            for h in hosts[:10]:
-                text += f"• `{h['host']}`\n"
-            if len(hosts) > 10:
-                text += f"\n...and {len(hosts)-10} more"
-            
-            text += "\n⚠️ TOTP code will be required."
-            
-            from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-            keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text, parse_mode="Markdown", reply_markup=reply_markup)
-        except Exception as e:
-            await query.edit_message_text(f"❌ Error: {str(e)}")
-        return
-    
-    if data == "shutdown":
-        _pending_operations[user_id] = {"operation": "shutdown", "state": "awaiting_otp"}
-        
-        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-        keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            "🚨 EMERGENCY SHUTDOWN (ALL HOSTS)\n\n"
-            "⚠️ This will shutdown ALL infrastructure!\n\n"
-            "Send your TOTP code to confirm.",
-            reply_markup=reply_markup
+    except Exception as e:
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+
+async def _msg_add_api(update: Any, user_id: int, message_text: str, delimiter: str):
+    """Handle an `api:type:host:key:endpoint:description` add request."""
+    try:
+        # Partition chain: each field is peeled off in turn without building
+        # an intermediate list or re-counting segments
+        _, _, rest = message_text.partition(delimiter)
+        api_type, sep1, rest = rest.partition(delimiter)
+        host, sep2, rest = rest.partition(delimiter)
+        if not (sep1 and sep2):
+            await update.message.reply_text("❌ Invalid format. Need: api:type:host:api_key:api_endpoint:description (or use | as delimiter)")
+            return
+
+        api_key, _, rest = rest.partition(delimiter)
+        api_endpoint, _, rest = rest.partition(delimiter)
+        description = rest.partition(delimiter)[0]
+
+        # Trim accidental whitespace/newlines from individual fields to avoid login failures
+        api_type = api_type.strip()
+        host = host.strip()
+        api_key = api_key.strip()
+        api_endpoint = api_endpoint.strip()
+        description = description.strip()
+
+
+        if api_type not in list_plugins():
+            await update.message.reply_text(f"❌ Unknown type: {api_type}")
+            return
+
+        # Blocking network probe; run it off the event loop so the bot
+        # keeps handling updates while the connection test runs
+        test = await asyncio.to_thread(test_api_connection, host, api_type, api_key, api_endpoint)
+
+        if not test["success"]:
+            await update.message.reply_text(f"❌ Connection test failed: {test['error']}")
+            return
+
+        _pending_operations[user_id] = {
+            "operation": "add_api",
+            "state": "awaiting_otp",
+            "data": {"host": host, "api_type": api_type, "api_key": api_key, "api_endpoint": api_endpoint, "description": description}
+        }
+        await _delete_and_prompt(
+            update.message,
+            f"✅ Connection test successful\n\n"
+            f"Send your TOTP code to confirm adding:\n`{host}` ({api_type})",
+            parse_mode="Markdown"
         )
-        return
-    
-    if data == "selective_shutdown":
-        try:
-            from database import get_all_ssh_hosts, get_all_api_hosts
-            ssh_hosts = get_all_ssh_hosts(enabled_only=True)
-            api_hosts = get_all_api_hosts(enabled_only=True)
-            
-            if not ssh_hosts and not api_hosts:
-                from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-                keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.edit_message_text(
-                    "📋 No hosts available for shutdown.",
-                    reply_markup=reply_markup
-                )
-                return
-            
-            text = "⚡ **Selective Shutdown**\n\nChoose hosts to shutdown:\n\n"
-            text += "Send host identifiers (comma-separated):\n\n"
-            
-            host_list = []
-            if ssh_hosts:
-                text += "**SSH Hosts:**\n"
-                for idx, h in enumerate(ssh_hosts, 1):
-                    host_id = f"ssh:{h['host']}:{h['user']}"
-                    host_list.append(host_id)
-                    text += f"{idx}. `{h['user']}@{h['host']}`\n"
-                text += "\n"
-            
-            if api_hosts:
-                text += "**API Hosts:**\n"
-                offset = len(ssh_hosts)
-                for idx, h in enumerate(api_hosts, offset + 1):
-                    host_id = f"api:{h['host']}:{h['api_type']}"
-                    host_list.append(host_id)
-                    text += f"{idx}. `{h['host']}` ({h['api_type']})\n"
-                text += "\n"
-            
-            text += "\nExamples:\n"
-            text += "`1,3,5` to shutdown hosts 1, 3, and 5\n"
-            text += "`1-4` to shutdown hosts 1 through 4\n"
-            text += "`all` to shutdown all hosts\n"
-            
-            _pending_operations[user_id] = {
-                "operation": "selective_shutdown",
-                "state": "awaiting_selection",
-                "host_list": host_list
-            }
-            
-            from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-            keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text, parse_mode="Markdown", reply_markup=reply_markup)
-        except Exception as e:
-            await query.edit_message_text(f"❌ Error: {str(e)}")
-        return
+    except Exception as e:
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+
+# First delimiter found in the message; (prefix, delimiter) picks the add flow
+_PREFIX_RE = re.compile(r'([^:|]*)([:|])')
+
+_ADD_FLOWS = {
+    ("ssh", ":"): _msg_add_ssh,
+    ("api", ":"): _msg_add_api,
+    ("api", "|"): _msg_add_api,
+}
 
 
 async def _message_handler(update: Any, context: Any):
     """Handle text messages."""
     user_id = update.effective_user.id
     
-    if str(user_id) != TELEGRAM_CHAT_ID:
+    if not _is_authorized(user_id):
         return
     
     message_text = update.message.text.strip()
     
-    if user_id in _pending_auth:
-        state = _pending_auth[user_id]
-        
+    pending = _pending_auth.get(user_id)
+    if pending is not None:
+        state = pending.get("state")
+        prompt_id = pending.get("msg_id")
+
         if state == "awaiting_token":
             try:
-                from auth import verify_static_token_value
-                
+
                 if verify_static_token_value(message_text):
-                    _pending_auth[user_id] = "awaiting_otp"
+                    _pending_auth[user_id] = {"state": "awaiting_otp", "msg_id": prompt_id}
                     try:
                         await update.message.delete()
-                    except:
+                    except (BadRequest, Forbidden):
                         pass
-                    await update.message.reply_text(
+                    await _update_auth_prompt(
+                        update, context, prompt_id,
                         "✅ Token verified\n\n"
                         "🔐 Authentication (Step 2/2)\n\n"
                         "Send your TOTP code."
                     )
                 else:
                     await update.message.reply_text("❌ Invalid token")
-                    del _pending_auth[user_id]
-                    logger.warning(f"Invalid token from user {user_id}")
+                    _pending_auth.pop(user_id, None)
+                    logger.warning("Invalid token from user %s", user_id)
             except Exception as e:
                 await update.message.reply_text(f"❌ Error: {str(e)}")
-                del _pending_auth[user_id]
+                _pending_auth.pop(user_id, None)
             return
         
         if state == "awaiting_otp":
             try:
-                from auth import verify_totp
-                from database import add_telegram_session
                 
-                if verify_totp(message_text):
+                verified = await _check_totp(user_id, message_text)
+                if verified is None:
+                    # Keep the pending auth state so a retry after the
+                    # window works without restarting the login flow
+                    await update.message.reply_text(
+                        "⏳ Too many attempts — wait a minute, then resend your TOTP code."
+                    )
+                elif verified:
                     add_telegram_session(user_id)
-                    del _pending_auth[user_id]
-                    
+                    _valid_sessions[user_id] = True
+                    _pending_auth.pop(user_id, None)
+
                     try:
                         await update.message.delete()
-                    except:
+                    except (BadRequest, Forbidden):
                         pass
-                    
-                    await update.message.reply_text("✅ Authenticated (expires in 24h)")
-                    logger.info(f"User {user_id} authenticated")
-                    
-                    await _show_main_menu(update, True)
+
+                    # One edit replaces the confirmation reply + fresh menu
+                    await _update_auth_prompt(
+                        update, context, prompt_id,
+                        "✅ Authenticated (expires in 24h)\n\n"
+                        "🛡️ Control Panel (Authenticated)\n\nSelect an operation:",
+                        reply_markup=_AUTH_MENU_MARKUP
+                    )
+                    logger.info("User %s authenticated", user_id)
                 else:
                     await update.message.reply_text("❌ Invalid TOTP code")
-                    del _pending_auth[user_id]
-                    logger.warning(f"Invalid TOTP from user {user_id}")
+                    _pending_auth.pop(user_id, None)
+                    logger.warning("Invalid TOTP from user %s", user_id)
             except Exception as e:
                 await update.message.reply_text(f"❌ Error: {str(e)}")
-                del _pending_auth[user_id]
-        return
-    
-    from database import is_telegram_session_valid
-    if not is_telegram_session_valid(user_id):
+                _pending_auth.pop(user_id, None)
         return
     
-    # Handle explicit commands (ssh:, api:) BEFORE checking pending operations
-    # to avoid conflicts with selective shutdown selection state
-    if message_text.startswith("ssh:"):
-        try:
-            parts = message_text.split(":", 5)
-            if len(parts) < 3:
-                await update.message.reply_text("❌ Invalid format. Need: ssh:host:user::description")
-                return
-            
-            _, host, user = parts[:3]
-            # command field deprecated; allow empty segment
-            description = parts[4] if len(parts) > 4 else (parts[3] if len(parts) > 3 else "")
-            
-            from dms_logic import test_ssh_connection
-            
-            test = test_ssh_connection(host, user)
-            
-            if not test["success"]:
-                await update.message.reply_text(f"❌ Connection test failed: {test['error']}")
-                return
-            
-            try:
-                await update.message.delete()
-            except:
-                pass
-            
-            _pending_operations[user_id] = {
-                "operation": "add_ssh",
-                "state": "awaiting_otp",
-                "data": {"host": host, "user": user, "description": description}
-            }
-            await update.message.reply_text(
-                f"✅ Connection test successful\n\n"
-                f"Send your TOTP code to confirm adding:\n`{user}@{host}`",
-                parse_mode="Markdown"
-            )
-        except Exception as e:
-            await update.message.reply_text(f"❌ Error: {str(e)}")
-        return
-    
-    if message_text.startswith(("api:", "api|")):
-        try:
-            delimiter = ":" if message_text.startswith("api:") else "|"
-            parts = message_text.split(delimiter, 6)
-            if len(parts) < 4:
-                await update.message.reply_text("❌ Invalid format. Need: api:type:host:api_key:api_endpoint:description (or use | as delimiter)")
-                return
-            
-            _, api_type, host, api_key = parts[:4]
-            api_endpoint = parts[4] if len(parts) > 4 else ""
-            description = parts[5] if len(parts) > 5 else ""
-
-            # Trim accidental whitespace/newlines from individual fields to avoid login failures
-            api_type = api_type.strip()
-            host = host.strip()
-            api_key = api_key.strip()
-            api_endpoint = api_endpoint.strip()
-            description = description.strip()
-            
-            from dms_logic import test_api_connection
-            from plugins import list_plugins
-            
-            if api_type not in list_plugins():
-                await update.message.reply_text(f"❌ Unknown type: {api_type}")
-                return
-            
-            test = test_api_connection(host, api_type, api_key, api_endpoint)
-            
-            if not test["success"]:
-                await update.message.reply_text(f"❌ Connection test failed: {test['error']}")
-                return
-            
-            try:
-                await update.message.delete()
-            except:
-                pass
-            
-            _pending_operations[user_id] = {
-                "operation": "add_api",
-                "state": "awaiting_otp",
-                "data": {"host": host, "api_type": api_type, "api_key": api_key, "api_endpoint": api_endpoint, "description": description}
-            }
-            await update.message.reply_text(
-                f"✅ Connection test successful\n\n"
-                f"Send your TOTP code to confirm adding:\n`{host}` ({api_type})",
-                parse_mode="Markdown"
-            )
-        except Exception as e:
-            await update.message.reply_text(f"❌ Error: {str(e)}")
+    if not _session_valid(user_id):
         return
     
+    # Handle explicit add commands (ssh:, api:, api|) BEFORE checking pending
+    # operations to avoid conflicts with selective shutdown selection state.
+    # One scan finds the first delimiter and the (prefix, delimiter) pair
+    # picks the flow, replacing the chain of startswith probes.
+    m = _PREFIX_RE.match(message_text)
+    if m:
+        flow = _ADD_FLOWS.get((m.group(1), m.group(2)))
+        if flow is not None:
+            await flow(update, user_id, message_text, m.group(2))
+            return
+
     # Now check pending operations for state-based flows
-    if user_id in _pending_operations:
-        op = _pending_operations[user_id]
+    op = _pending_operations.get(user_id)
+    if op is not None:
         
         if op.get("operation") == "selective_shutdown" and op.get("state") == "awaiting_selection":
             try:
@@ -761,35 +1095,21 @@ async def _message_handler(update: Any, context: Any):
                 
                 if not host_list:
                     await update.message.reply_text("❌ No hosts available")
-                    del _pending_operations[user_id]
+                    _pending_operations.pop(user_id, None)
                     return
                 
-                selected_indices = []
                 if selection == "all":
-                    selected_indices = list(range(len(host_list)))
+                    selected_hosts = list(host_list)
                 else:
-                    # Parse comma-separated and ranges
-                    for part in selection.split(","):
-                        part = part.strip()
-                        if "-" in part:
-                            try:
-                                start, end = part.split("-")
-                                start_idx = int(start.strip()) - 1
-                                end_idx = int(end.strip()) - 1
-                                selected_indices.extend(range(start_idx, end_idx + 1))
-                            except:
-                                pass
-                        else:
-                            try:
-                                selected_indices.append(int(part) - 1)
-                            except:
-                                pass
-                
-                # Validate and collect hosts
-                selected_hosts = []
-                for idx in selected_indices:
-                    if 0 <= idx < len(host_list):
-                        selected_hosts.append(host_list[idx])
+                    # Single regex pass over "1,3,5" / "1-4" style selections;
+                    # clamping to the list bounds replaces the validity filter
+                    total = len(host_list)
+                    selected_hosts = []
+                    for m in _SELECTION_RE.finditer(selection):
+                        start = int(m.group(1))
+                        end = int(m.group(2)) if m.group(2) else start
+                        for idx in range(max(1, start) - 1, min(total, end)):
+                            selected_hosts.append(host_list[idx])
                 
                 if not selected_hosts:
                     await update.message.reply_text("❌ Invalid selection. Try again or send /start to cancel.")
@@ -798,18 +1118,21 @@ async def _message_handler(update: Any, context: Any):
                 # Show confirmation
                 try:
                     await update.message.delete()
-                except:
+                except (BadRequest, Forbidden):
                     pass
                 
-                text = f"⚠️ **Confirm Selective Shutdown**\n\n"
-                text += f"**Selected {len(selected_hosts)} host(s):**\n"
+                lines = [
+                    "⚠️ **Confirm Selective Shutdown**\n\n",
+                    f"**Selected {len(selected_hosts)} host(s):**\n"
+                ]
                 for host_id in selected_hosts:
                     parts = host_id.split(":", 2)
                     if parts[0] == "ssh":
-                        text += f"• SSH: `{parts[2]}@{parts[1]}`\n"
+                        lines.append(f"• SSH: `{parts[2]}@{parts[1]}`\n")
                     else:
-                        text += f"• API: `{parts[1]}` ({parts[2]})\n"
-                text += f"\nSend your TOTP code to confirm shutdown."
+                        lines.append(f"• API: `{parts[1]}` ({parts[2]})\n")
+                lines.append("\nSend your TOTP code to confirm shutdown.")
+                text = "".join(lines)
                 
                 _pending_operations[user_id] = {
                     "operation": "selective_shutdown",
@@ -820,21 +1143,28 @@ async def _message_handler(update: Any, context: Any):
                 await update.message.reply_text(text, parse_mode="Markdown")
             except Exception as e:
                 await update.message.reply_text(f"❌ Error: {str(e)}")
-                del _pending_operations[user_id]
+                _pending_operations.pop(user_id, None)
             return
         
         if op["state"] == "awaiting_otp":
             try:
-                from auth import verify_totp
                 
-                if verify_totp(message_text):
+                verified = await _check_totp(user_id, message_text)
+                if verified is None:
+                    # Keep the pending operation so a retry after the
+                    # window doesn't force re-selecting hosts
+                    await update.message.reply_text(
+                        "⏳ Too many attempts — wait a minute, then resend your TOTP code."
+                    )
+                    return
+                if verified:
                     operation = op["operation"]
                     data = op.get("data", {})
-                    del _pending_operations[user_id]
+                    _pending_operations.pop(user_id, None)
                     
                     try:
                         await update.message.delete()
-                    except:
+                    except (BadRequest, Forbidden):
                         pass
                     
                     if operation == "shutdown":
@@ -843,52 +1173,47 @@ async def _message_handler(update: Any, context: Any):
                             "🚨 INITIATING EMERGENCY SHUTDOWN..."
                         )
                         
-                        from dms_logic import initiate_hard_poweroff
-                        result = initiate_hard_poweroff()
+                        # Sequential multi-phase shutdown with network
+                        # timeouts; must not park the server loop
+                        result = await asyncio.to_thread(initiate_hard_poweroff)
                         
                         # Build detailed results message
-                        text = "🚨 **EMERGENCY SHUTDOWN EXECUTED**\n\n"
-                        
+                        parts = ["🚨 **EMERGENCY SHUTDOWN EXECUTED**\n\n"]
+
                         # Show results for each phase
                         results = result.get("results", {})
                         total_hosts = 0
                         success_count = 0
-                        
+
                         for phase, hosts in results.items():
                             if hosts:
-                                text += f"**{phase.upper()}:**\n"
+                                parts.append(f"**{phase.upper()}:**\n")
                                 for h in hosts:
                                     total_hosts += 1
                                     host_name = h.get("host", "unknown")
                                     status = h.get("status", "unknown")
                                     details = h.get("details", "")
-                                    
-                                    if status in ["shutdown_initiated", "executed"]:
-                                        icon = "✅"
+
+                                    icon = _STATUS_ICON.get(status, "❌")
+                                    if status in _SUCCESS_STATUSES:
                                         success_count += 1
-                                    elif status == "timeout":
-                                        icon = "⏱️"
-                                        success_count += 1  # timeout often means it worked
-                                    else:
-                                        icon = "❌"
-                                    
-                                    text += f"{icon} `{host_name}` - {status}\n"
-                                    if details and status not in ["shutdown_initiated", "executed"]:
-                                        text += f"   _{details[:50]}_\n"
-                                text += "\n"
-                        
-                        text += f"**Summary:** {success_count}/{total_hosts} hosts executed\n"
-                        
-                        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-                        keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="back")]]
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-                        
+
+                                    parts.append(f"{icon} `{host_name}` - {status}\n")
+                                    if details and status not in _CLEAN_STATUSES:
+                                        parts.append(f"   _{details[:50]}_\n")
+                                parts.append("\n")
+
+                        parts.append(f"**Summary:** {success_count}/{total_hosts} hosts executed\n")
+                        text = "".join(parts)
+
+                        reply_markup = _BACK_MENU_MARKUP
+
                         try:
                             await status_msg.edit_text(text, parse_mode="Markdown", reply_markup=reply_markup)
-                        except:
+                        except (BadRequest, Forbidden):
                             await update.message.reply_text(text, parse_mode="Markdown", reply_markup=reply_markup)
                         
-                        logger.critical(f"Shutdown triggered via Telegram by user {user_id}")
+                        logger.critical("Shutdown triggered via Telegram by user %s", user_id)
                     
                     elif operation == "selective_shutdown":
                         selected_hosts = op.get("selected_hosts", [])
@@ -902,170 +1227,179 @@ async def _message_handler(update: Any, context: Any):
                         )
                         
                         # Execute selective shutdown
-                        from dms_logic import execute_shutdown_phase
-                        from database import get_all_ssh_hosts, get_all_api_hosts
-                        
+
                         results = {"ssh": [], "api": []}
-                        
+
+                        # Fetch each host list once and index it by key, so
+                        # resolving N selections is N dict probes instead of
+                        # N linear scans over re-fetched lists
+                        ssh_idx = {(h['host'], h['user']): h for h in _cached_ssh_hosts(enabled_only=True)}
+                        api_idx = {(h['host'], h['api_type']): h for h in _cached_api_hosts(enabled_only=True)}
+
+                        # Group targets so each plugin kind gets a single
+                        # execute_shutdown_phase call (one batch for ssh, one
+                        # per api_type) instead of a call per host; the phase
+                        # call fans out per host internally, so hosts stay
+                        # concurrent within each batch as well as across them
+                        ssh_targets = []
+                        api_groups = defaultdict(list)
                         for host_id in selected_hosts:
                             parts = host_id.split(":", 2)
                             if parts[0] == "ssh":
-                                # Find SSH host
-                                ssh_hosts = get_all_ssh_hosts(enabled_only=True)
-                                target = next((h for h in ssh_hosts if h['host'] == parts[1] and h['user'] == parts[2]), None)
+                                target = ssh_idx.get((parts[1], parts[2]))
                                 if target:
-                                    result = execute_shutdown_phase([target], "ssh", "SSH")
-                                    results["ssh"].extend(result)
+                                    ssh_targets.append(target)
                             elif parts[0] == "api":
-                                # Find API host
-                                api_hosts = get_all_api_hosts(enabled_only=True)
-                                target = next((h for h in api_hosts if h['host'] == parts[1] and h['api_type'] == parts[2]), None)
+                                target = api_idx.get((parts[1], parts[2]))
                                 if target:
-                                    result = execute_shutdown_phase([target], parts[2], parts[2].upper())
-                                    results["api"].extend(result)
+                                    api_groups[parts[2]].append(target)
+
+                        jobs = []
+                        if ssh_targets:
+                            jobs.append(("ssh", ssh_targets, "ssh", "SSH"))
+                        for api_type, targets in api_groups.items():
+                            jobs.append(("api", targets, api_type, api_type.upper()))
+
+                        if jobs:
+                            loop = asyncio.get_running_loop()
+                            with ThreadPoolExecutor(max_workers=min(32, len(jobs))) as pool:
+                                outcomes = await asyncio.gather(*(
+                                    loop.run_in_executor(pool, execute_shutdown_phase, targets, plugin, phase)
+                                    for _, targets, plugin, phase in jobs
+                                ))
+                            for (kind, _, _, _), outcome in zip(jobs, outcomes):
+                                results[kind].extend(outcome)
                         
-                        # Build results message (use HTML to avoid Markdown parsing issues)
-                        text = "⚡ <b>SELECTIVE SHUTDOWN EXECUTED</b>\n\n"
+                        # Build results message (use HTML to avoid Markdown
+                        # parsing issues); append parts and join once instead
+                        # of rebuilding the string on every +=
+                        parts = ["⚡ <b>SELECTIVE SHUTDOWN EXECUTED</b>\n\n"]
                         total_hosts = 0
                         success_count = 0
-                        
+
                         for phase, hosts in results.items():
                             if hosts:
-                                text += f"<b>{phase.upper()}:</b>\n"
+                                parts.append(f"<b>{phase.upper()}:</b>\n")
                                 for h in hosts:
                                     total_hosts += 1
                                     host_name = h.get("host", "unknown")
                                     status = h.get("status", "unknown")
                                     details = h.get("details", "")
-                                    
-                                    if status in ["shutdown_initiated", "executed"]:
-                                        icon = "✅"
-                                        success_count += 1
-                                    elif status == "timeout":
-                                        icon = "⏱️"
+
+                                    icon = _STATUS_ICON.get(status, "❌")
+                                    if status in _SUCCESS_STATUSES:
                                         success_count += 1
-                                    else:
-                                        icon = "❌"
-                                    
+
                                     # Escape HTML special chars
                                     host_name_safe = host_name.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
                                     status_safe = status.replace("_", " ")
-                                    text += f"{icon} <code>{host_name_safe}</code> - {status_safe}\n"
-                                    if details and status not in ["shutdown_initiated", "executed"]:
+                                    parts.append(f"{icon} <code>{host_name_safe}</code> - {status_safe}\n")
+                                    if details and status not in _CLEAN_STATUSES:
                                         details_safe = details[:50].replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-                                        text += f"   <i>{details_safe}</i>\n"
-                                text += "\n"
-                        
-                        text += f"<b>Summary:</b> {success_count}/{total_hosts} hosts executed\n"
-                        
-                        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-                        keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="back")]]
-                        reply_markup = InlineKeyboardMarkup(keyboard)
+                                        parts.append(f"   <i>{details_safe}</i>\n")
+                                parts.append("\n")
+
+                        parts.append(f"<b>Summary:</b> {success_count}/{total_hosts} hosts executed\n")
+                        text = "".join(parts)
                         
+                        reply_markup = _BACK_MENU_MARKUP
+
                         try:
                             await status_msg.edit_text(text, parse_mode="HTML", reply_markup=reply_markup)
                         except Exception as e:
-                            logger.error(f"Failed to edit selective shutdown message: {e}")
+                            logger.error("Failed to edit selective shutdown message: %s", e)
                             try:
                                 await update.message.reply_text(text, parse_mode="HTML", reply_markup=reply_markup)
                             except Exception as e2:
-                                logger.error(f"Failed to send selective shutdown message: {e2}")
+                                logger.error("Failed to send selective shutdown message: %s", e2)
                         
-                        logger.critical(f"Selective shutdown triggered via Telegram by user {user_id}: {len(selected_hosts)} hosts")
+                        logger.critical("Selective shutdown triggered via Telegram by user %s: %d hosts", user_id, len(selected_hosts))
                     
                     elif operation == "add_ssh":
-                        from database import add_ssh_host, get_all_ssh_hosts
                         if add_ssh_host(data["host"], data["user"], data["description"]):
-                            # Test immediately after adding
-                            from dms_logic import monitor_ssh_host
-                            hosts = get_all_ssh_hosts(enabled_only=False)
-                            host_data = next((h for h in hosts if h['host'] == data['host'] and h['user'] == data['user']), None)
+                            _invalidate_host_cache()
+                            # Probe immediately after adding, but don't make
+                            # the confirmation reply wait on the result; the
+                            # status lands via the normal monitoring columns
+                            host_data = get_ssh_host(data['host'], data['user'])
                             if host_data:
-                                monitor_ssh_host(host_data)
+                                asyncio.create_task(asyncio.to_thread(monitor_ssh_host, host_data))
                             
                             await update.message.reply_text(f"✅ SSH host added: {data['user']}@{data['host']}")
-                            logger.info(f"SSH host {data['user']}@{data['host']} added via Telegram by user {user_id}")
+                            logger.info("SSH host %s@%s added via Telegram by user %s", data['user'], data['host'], user_id)
                             await _show_main_menu(update, True)
                         else:
                             await update.message.reply_text("❌ Failed to add host (may already exist)")
                     
                     elif operation == "add_api":
-                        from database import add_api_host, get_all_api_hosts
                         if add_api_host(data["host"], data["api_type"], data["api_key"], data["api_endpoint"], data["description"]):
-                            # Test immediately after adding
-                            from dms_logic import monitor_api_host
-                            hosts = get_all_api_hosts(enabled_only=False)
-                            host_data = next((h for h in hosts if h['host'] == data['host']), None)
+                            _invalidate_host_cache()
+                            # Probe immediately after adding, but don't make
+                            # the confirmation reply wait on the result; the
+                            # status lands via the normal monitoring columns
+                            host_data = get_api_host(data['host'])
                             if host_data:
-                                monitor_api_host(host_data)
+                                asyncio.create_task(asyncio.to_thread(monitor_api_host, host_data))
                             
                             await update.message.reply_text(f"✅ API host added: {data['host']} ({data['api_type']})")
-                            logger.info(f"API host {data['host']} ({data['api_type']}) added via Telegram by user {user_id}")
+                            logger.info("API host %s (%s) added via Telegram by user %s", data['host'], data['api_type'], user_id)
                             await _show_main_menu(update, True)
                         else:
                             await update.message.reply_text("❌ Failed to add host (may already exist)")
                     
                     elif operation == "remove_ssh":
-                        from database import delete_ssh_host
                         if delete_ssh_host(data["host"], data["user"]):
+                            _invalidate_host_cache()
                             await update.message.reply_text(f"✅ SSH host removed: {data['user']}@{data['host']}")
-                            logger.info(f"SSH host {data['user']}@{data['host']} removed via Telegram by user {user_id}")
+                            logger.info("SSH host %s@%s removed via Telegram by user %s", data['user'], data['host'], user_id)
                             await _show_main_menu(update, True)
                         else:
                             await update.message.reply_text("❌ Host not found")
                     
                     elif operation == "remove_api":
-                        from database import delete_api_host
                         if delete_api_host(data["host"]):
+                            _invalidate_host_cache()
                             await update.message.reply_text(f"✅ API host removed: {data['host']}")
-                            logger.info(f"API host {data['host']} removed via Telegram by user {user_id}")
+                            logger.info("API host %s removed via Telegram by user %s", data['host'], user_id)
                             await _show_main_menu(update, True)
                         else:
                             await update.message.reply_text("❌ Host not found")
                 else:
                     await update.message.reply_text("❌ Invalid TOTP code")
-                    if user_id in _pending_operations:
-                        del _pending_operations[user_id]
-                    logger.warning(f"Invalid TOTP from user {user_id}")
+                    _pending_operations.pop(user_id, None)
+                    logger.warning("Invalid TOTP from user %s", user_id)
             except Exception as e:
                 await update.message.reply_text(f"❌ Error: {str(e)}")
-                if user_id in _pending_operations:
-                    del _pending_operations[user_id]
+                _pending_operations.pop(user_id, None)
         return
     
-    # Remove host (SSH if has colon, API otherwise)
-    if ":" in message_text and not message_text.startswith(("ssh:", "api:")):
-        parts = message_text.split(":")
-        if len(parts) == 2:
-            try:
-                await update.message.delete()
-            except:
-                pass
-            
-            _pending_operations[user_id] = {
-                "operation": "remove_ssh",
-                "state": "awaiting_otp",
-                "data": {"host": parts[0], "user": parts[1]}
-            }
-            await update.message.reply_text(
-                f"⚠️ Remove SSH host:\n`{parts[1]}@{parts[0]}`\n\n"
-                f"Send your TOTP code to confirm.",
-                parse_mode="Markdown"
-            )
-            return
-    
-    if not message_text.startswith(("ssh:", "api:")) and ":" not in message_text and len(message_text) > 3:
-        try:
-            await update.message.delete()
-        except:
-            pass
-        
+    # Remove host: exactly one colon means SSH (host:user), none means API.
+    # Counting once replaces the repeated membership/startswith tests; the
+    # ssh:/api: prefixed forms already returned above.
+    colons = message_text.count(":")
+    if colons == 1:
+        host, _, user = message_text.partition(":")
+        _pending_operations[user_id] = {
+            "operation": "remove_ssh",
+            "state": "awaiting_otp",
+            "data": {"host": host, "user": user}
+        }
+        await _delete_and_prompt(
+            update.message,
+            f"⚠️ Remove SSH host:\n`{user}@{host}`\n\n"
+            f"Send your TOTP code to confirm.",
+            parse_mode="Markdown"
+        )
+        return
+
+    if colons == 0 and len(message_text) > 3:
         _pending_operations[user_id] = {
             "operation": "remove_api",
             "state": "awaiting_otp",
             "data": {"host": message_text}
         }
-        await update.message.reply_text(
+        await _delete_and_prompt(
+            update.message,
             f"⚠️ Remove API host:\n`{message_text}`\n\n"
             f"Send your TOTP code to confirm.",
             parse_mode="Markdown"
@@ -1073,57 +1407,140 @@ async def _message_handler(update: Any, context: Any):
         return
 
 
-def _run_bot_polling_sync():
-    """Run bot polling in background thread using async approach."""
-    import asyncio
-    
-    async def _async_main():
-        from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
-        from telegram import Update
+def _build_application():
+    """Build the PTB Application with rate limiting and all handlers attached."""
+    from telegram.ext import Application, AIORateLimiter, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+
+    # Rate-limit every outbound API call issued by handlers so bursty
+    # status/shutdown flows never trip Telegram's 429 backoff
+    app = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .rate_limiter(AIORateLimiter(overall_max_rate=30, overall_time_period=1, max_retries=3))
+        .build()
+    )
+
+    app.add_handler(CommandHandler("start", _cmd_start))
+    app.add_handler(CommandHandler("status", _cmd_status))
+    app.add_handler(CommandHandler("logout", _cmd_logout))
+    app.add_handler(CallbackQueryHandler(_button_callback))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, _message_handler))
+
+    logger.info("Telegram bot handlers registered")
+    return app
 
-        app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
 
-        app.add_handler(CommandHandler("start", _cmd_start))
-        app.add_handler(CommandHandler("status", _cmd_status))
-        app.add_handler(CommandHandler("logout", _cmd_logout))
-        app.add_handler(CallbackQueryHandler(_button_callback))
-        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, _message_handler))
+def is_webhook_configured() -> bool:
+    """True when updates should arrive via webhook instead of polling."""
+    return _telegram_enabled and bool(TELEGRAM_WEBHOOK_URL)
 
-        logger.info("Telegram bot handlers registered")
-        logger.info("Bot ready for commands")
 
-        # Initialize and start polling manually for background thread compatibility
+def verify_webhook_secret(token: str) -> bool:
+    """Constant-time check of the X-Telegram-Bot-Api-Secret-Token header."""
+    return secrets.compare_digest(token or "", TELEGRAM_WEBHOOK_SECRET)
+
+
+async def start_webhook():
+    """Start the bot in webhook mode: Telegram pushes updates to our API."""
+    global _application
+    if not is_webhook_configured():
+        return
+    from telegram import Update
+
+    _application = _build_application()
+    await _application.initialize()
+    await _application.start()
+    # Match the polling setup: subscribe to every update type and discard
+    # whatever queued up while we were down instead of replaying stale
+    # button taps and commands on startup
+    await _application.bot.set_webhook(
+        url=TELEGRAM_WEBHOOK_URL,
+        secret_token=TELEGRAM_WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=True
+    )
+    logger.info("Telegram webhook registered, long polling disabled")
+
+
+async def stop_webhook():
+    """Deregister the webhook and shut the Application down cleanly."""
+    global _application
+    if _application is None:
+        return
+    try:
+        await _application.bot.delete_webhook()
+    except Exception as e:
+        logger.error("Failed to delete webhook: %s", e)
+    await _application.stop()
+    await _application.shutdown()
+    _application = None
+
+
+async def process_webhook_update(data: dict):
+    """Queue one pushed update payload for the Application's handlers.
+
+    Enqueuing (rather than awaiting process_update) lets the HTTP
+    response return immediately; holding it open for a long handler
+    (shutdown flows) makes Telegram time out and re-deliver the update,
+    running the handler twice. The Application is started, so its
+    fetcher drains update_queue in the background.
+    """
+    if _application is None:
+        return
+    from telegram import Update
+    update = Update.de_json(data, _application.bot)
+    if update:
+        await _application.update_queue.put(update)
+
+
+async def _run_polling():
+    """Run the bot's polling lifecycle as a task on the server's event loop."""
+    from telegram import Update
+
+    app = _build_application()
+    logger.info("Bot ready for commands")
+
+    try:
         async with app:
             await app.start()
             logger.info("Telegram bot started successfully")
-            # Start polling without signals (safe for background threads)
+            # Start polling without signals (we are not the main coroutine)
             if app.updater:
                 await app.updater.start_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
-            # Keep running
+            # Keep running until the task is cancelled at shutdown
             await asyncio.Event().wait()
-    
-    try:
-        asyncio.run(_async_main())
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
-        logger.error(f"Bot polling error: {e}")
+        logger.error("Bot polling error: %s", e)
+
+
+# Keeps a reference so the polling task is not garbage collected
+_bot_task: Optional["asyncio.Task"] = None
 
 
 def start_bot():
-    """Start Telegram bot in background task."""
+    """Start Telegram bot as a task on the running event loop."""
+    global _bot_task
     if not _telegram_enabled:
         logger.info("Telegram bot disabled (not configured)")
         return
-    
+
     try:
         logger.info("Starting Telegram bot polling...")
-        import threading
+        # Scheduling on uvicorn's own loop avoids a dedicated thread plus a
+        # second event loop just to host the updater
+        loop = asyncio.get_running_loop()
+        _bot_task = loop.create_task(_run_polling())
+        logger.info("Telegram bot task scheduled")
 
-        bot_thread = threading.Thread(target=_run_bot_polling_sync, daemon=True)
+    except RuntimeError:
+        # No running loop (invoked from sync code); fall back to a thread
+        bot_thread = threading.Thread(target=lambda: asyncio.run(_run_polling()), daemon=True)
         bot_thread.start()
         logger.info("Telegram bot thread started")
-        
     except Exception as e:
-        logger.error(f"Failed to start Telegram bot: {e}")
+        logger.error("Failed to start Telegram bot: %s", e)
         logger.error("Check token and network connectivity")
 
 